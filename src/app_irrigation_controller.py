@@ -1,4 +1,5 @@
 import time
+import math
 import datetime
 import json
 import jsonpickle
@@ -10,6 +11,8 @@ import mqtt_client_pubsub
 import command_queue
 import zone
 import elapsed_time
+import flow_monitor
+import profiler
 
 '''
 The Irrigation Controller subscribes to MQTT and awaits commands to run irrigation zones.
@@ -17,9 +20,12 @@ The app enforces certain rules to prevent overwatering and to ensure that the sy
 
 MQTT Subscriptions:
 command_queue - The command queue is used to send commands to the irrigation controller.
+flow_meters - (optional) flow meter topics; samples feed the flow monitor for leak / stuck valve detection.
 
 MQTT Publishes:
 command_status - contains a list of the queued commands and the current running time for each command.
+flow_status - rolling flow statistics, per-zone totals and the current flow alarm (only if flow meters are configured).
+profile_status - summary of an on-demand profile session (see the "Profile" command); the full report is written to disk.
 
 '''
 class IrrigationController:
@@ -44,6 +50,9 @@ class IrrigationController:
     _last_command_received = None
     _clear_queue = False
     _command_pause_timer = None
+    _flow_status_timer = None
+    _profile_request = None
+    _profile_session = None
     
     '''Class Init - Initialize the Irrigation Controller with the logger and config manager'''
     def __init__(self, 
@@ -52,6 +61,7 @@ class IrrigationController:
         self.logger = app_logger
         self.config = app_config
         self._command_queue = command_queue.CommandQueue()
+        self.flow_monitor = flow_monitor.FlowMonitor(app_config, app_logger)
         
         # Create and start the MQTT Client
         self.mqtt_client = mqtt_client_pubsub.MqttClient(app_config, 
@@ -60,6 +70,7 @@ class IrrigationController:
                                       self._publish_message_callback)
         self.mqtt_client.start()
         self._subscribe_to_command_queue()
+        self._subscribe_to_flow_meters()
 
     '''Blocking Run - Run the Irrigation Controller'''
     def run(self):
@@ -74,6 +85,11 @@ class IrrigationController:
                 if zone_command is not None:
                     self._change_state(self._STATE_STOPPING_COMMAND)
                 self._update_queue_status()
+            if self._profile_request is not None:
+                self._start_profile_session(self._profile_request)
+                self._profile_request = None
+            if self._profile_session is not None and self._profile_session.is_elapsed():
+                self._stop_profile_session()
             
             # State Machine
             if self._state == self._STATE_INIT:
@@ -131,6 +147,9 @@ class IrrigationController:
             else:
                 self.logger.write(self._LOG_KEY, "Unknown State - resetting to init.", logger.MessageLevel.ERROR)
             
+            # Flow Monitor
+            self._update_flow_status()
+            
             # Sleep for the loop delay
             time.sleep(self._LOOP_DELAY_MS / 1000)
             
@@ -138,6 +157,11 @@ class IrrigationController:
     def _subscribe_to_command_queue(self):
         self.logger.write(self._LOG_KEY, f"Subscribing to Command Queue ({self.config.active_config['subscribe']['command_queue']})", logger.MessageLevel.INFO)
         self.mqtt_client.subscribe(self.config.active_config['subscribe']['command_queue'])
+    
+    def _subscribe_to_flow_meters(self):
+        for meter_topic in self.flow_monitor.meter_topics:
+            self.logger.write(self._LOG_KEY, f"Subscribing to Flow Meter ({meter_topic})", logger.MessageLevel.INFO)
+            self.mqtt_client.subscribe(meter_topic, append_base=False)
 
     def _change_state(self, new_state : int):
         '''Change the state of the Irrigation Controller'''
@@ -173,6 +197,47 @@ class IrrigationController:
         json_str = jsonpickle.encode(json_dict, unpicklable=False)
         self.mqtt_client.publish(self.config.active_config['publish']['queue_status'], json_str)
         
+    def _update_flow_status(self):
+        '''Evaluate the flow monitor every loop; publish its status on the configured interval'''
+        if not self.flow_monitor.is_enabled():
+            return
+        json_dict = self.flow_monitor.evaluate()
+        if self._flow_status_timer is None or self._flow_status_timer.is_elapsed():
+            self._flow_status_timer = elapsed_time.ElapsedTime(datetime.timedelta(seconds=self.flow_monitor.status_interval_secs))
+            json_dict['status_time'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            json_str = jsonpickle.encode(json_dict, unpicklable=False)
+            self.mqtt_client.publish(self.flow_monitor.status_topic, json_str)
+        
+    def _start_profile_session(self, duration_seconds : float):
+        '''Start a time-boxed profile session on the main loop thread and trace the hot paths'''
+        if self._profile_session is not None:
+            self.logger.write(self._LOG_KEY, "Profile session already running; ignoring request.", logger.MessageLevel.WARN)
+            return
+        # A failed start (bad profiler config, another profiler active) must not stop the main loop
+        session = None
+        try:
+            session = profiler.ProfileSession(self.config, self.logger, duration_seconds)
+            session.trace(self.mqtt_client, '_new_message_callback', "IrrigationController._new_message_callback")
+            session.trace(self, '_update_queue_status', "IrrigationController._update_queue_status")
+            session.trace(self.logger, 'write', "logger.Logger.write")
+            session.start()
+            self._profile_session = session
+        except Exception as e:
+            if session is not None:
+                session.abort()
+            self.logger.write(self._LOG_KEY, f"Failed to start profile session: {e}", logger.MessageLevel.ERROR)
+        
+    def _stop_profile_session(self):
+        '''Stop the profile session and publish its summary; a failed report must not stop the main loop'''
+        session = self._profile_session
+        self._profile_session = None
+        try:
+            summary = session.stop()
+            json_str = jsonpickle.encode(summary, unpicklable=False)
+            self.mqtt_client.publish(session.status_topic, json_str)
+        except Exception as e:
+            self.logger.write(self._LOG_KEY, f"Failed to save/publish profile report: {e}", logger.MessageLevel.ERROR)
+        
     def _state_to_string(self) -> str:
         '''Convert the state to a string'''
         if self._state == self._STATE_INIT:
@@ -194,6 +259,10 @@ class IrrigationController:
         
     def _new_message_callback(self, topic : str, message : str):
         '''Received a new message from the MQTT Broker'''
+        # Flow samples are high rate - fold them into the flow monitor before any logging
+        if self.flow_monitor.is_meter_topic(topic):
+            self.flow_monitor.add_sample(topic, message)
+            return
         self.logger.write(self._LOG_KEY, f"New message: {topic}->[{message}]", logger.MessageLevel.INFO)
         self._last_command_received = message.decode('utf-8')
         command_queue_topic = f"{self.config.active_config['base_topic']}/{self.config.active_config['subscribe']['command_queue']}"
@@ -212,9 +281,23 @@ class IrrigationController:
                     self.logger.write(self._LOG_KEY, f"Failed to add command for {zone_command.zone_name}.", logger.MessageLevel.ERROR)
             elif command_dict['Command'] == "Clear":
                 self._clear_queue = True
+            elif command_dict['Command'] == "Profile":
+                # Example: {"Command": "Profile", "Duration_Secs": 60}
+                # Started by the main loop - cProfile only profiles the thread that enables it
+                duration_seconds = command_dict.get('Duration_Secs')
+                if self._is_valid_duration(duration_seconds):
+                    self._profile_request = duration_seconds
+                else:
+                    self.logger.write(self._LOG_KEY, f"Invalid profile duration: {duration_seconds}", logger.MessageLevel.ERROR)
             else:
                 self.logger.write(self._LOG_KEY, f"Unable to parse command: {message}", logger.MessageLevel.ERROR)
             
+    def _is_valid_duration(self, duration_seconds) -> bool:
+        '''Positive, finite number of seconds (bool is an int subclass; reject it)'''
+        if isinstance(duration_seconds, bool) or not isinstance(duration_seconds, (int, float)):
+            return False
+        return math.isfinite(duration_seconds) and duration_seconds > 0
+    
     def _get_zone_record_by_index(self, zone_index : int) -> zone.ZoneRecord:
         '''Get a zone record by the index'''
         for zone in self.config.active_config['zones'].values():
@@ -233,6 +316,7 @@ class IrrigationController:
             msg_info = self.mqtt_client.publish(mqtt_topic, mqtt_command, append_base=False)
             self.logger.write(self._LOG_KEY, f"{zone_command.zone.zone_name} state set to: [{state}].", logger.MessageLevel.INFO)
             zone_command.start()
+            self.flow_monitor.set_active_zone(zone_command.zone if state else None)
             return True
         except Exception as e:
             self.logger.write(self._LOG_KEY, f"Failed to set {zone_command.zone.zone_name} state: {e}", logger.MessageLevel.ERROR)
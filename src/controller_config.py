@@ -61,10 +61,28 @@ class ConfigManager:
         # Publish Topics - System
         self.active_config['subscribe']['command_queue'] = 'command_queue'
         self.active_config['publish']['queue_status'] = 'queue_status'   
+        self.active_config['publish']['flow_status'] = 'flow_status'
+        self.active_config['publish']['profile_status'] = 'profile_status'
+        
+        # Flow Meter Topics - full topic paths, no wildcards (not appended to base_topic); empty disables flow monitoring
+        self.active_config['subscribe']['flow_meters'] = []
         
         # System Config  
         self.active_config['delay_between_commands_secs'] = 5     
         
+        # Flow Monitor - rolling window leak / stuck valve detection (flow in units per minute)
+        self.active_config['flow_monitor']['window_secs'] = 30
+        self.active_config['flow_monitor']['bucket_secs'] = 1
+        self.active_config['flow_monitor']['settle_secs'] = 60
+        self.active_config['flow_monitor']['flow_tolerance_pct'] = 25
+        self.active_config['flow_monitor']['idle_flow_threshold'] = 0.5
+        self.active_config['flow_monitor']['max_sample_gap_secs'] = 5
+        self.active_config['flow_monitor']['status_interval_secs'] = 5
+        
+        # Profiler - on-demand profile sessions started by the "Profile" command
+        self.active_config['profiler']['max_duration_secs'] = 600
+        self.active_config['profiler']['top_functions'] = 15
+        
         # Zones
         zones = list()
         zones.append(zone.CreateZoneRecord('Zone 1 - Front Yard', 1, 'ioThinx_4510/write/Digital-Out-1@IrriSys_Zone1/doStatus', 1200))
@@ -0,0 +1,232 @@
+import time
+import math
+import json
+import threading
+from collections import defaultdict
+
+import logger
+import controller_config
+import zone
+
+'''
+Flow Monitor - folds flow meter samples into fixed-memory rolling windows and checks them against the running zone.
+
+Samples arrive on the MQTT thread at a high rate; each one is an O(1) update to a ring of time buckets and no raw
+samples are kept. The main loop calls evaluate() once per tick to compare the rolling mean flow against:
+    - the active zone's expected flow (high flow = leak / broken head, low flow = valve not opening)
+    - the idle flow threshold when no zone is running (flow while idle = stuck valve)
+
+Flow samples are rates in units per minute (e.g. GPM); zone totals are volumes in the same units.
+Meter topics must be full topic paths - incoming samples are matched by exact topic, so MQTT wildcards are rejected.
+'''
+
+# Alarm Constants
+ALARM_NONE = "NONE"
+ALARM_HIGH_FLOW = "HIGH_FLOW"
+ALARM_LOW_FLOW = "LOW_FLOW"
+ALARM_IDLE_FLOW = "IDLE_FLOW"
+ALARM_NO_DATA = "NO_DATA"
+
+class RollingWindow:
+    '''Fixed-memory rolling window of time buckets; add() is O(1), stats are O(bucket count)'''
+
+    def __init__(self, window_secs : float, bucket_secs : float):
+        self._bucket_secs = bucket_secs
+        self._bucket_count = max(1, int(round(window_secs / bucket_secs)))
+        self._bucket_ids = [-1] * self._bucket_count
+        self._sums = [0.0] * self._bucket_count
+        self._counts = [0] * self._bucket_count
+        self._maxes = [0.0] * self._bucket_count
+
+    def add(self, value : float, timestamp : float):
+        bucket_id = int(timestamp / self._bucket_secs)
+        index = bucket_id % self._bucket_count
+        if self._bucket_ids[index] != bucket_id:
+            # Slot holds an expired bucket; recycle it
+            self._bucket_ids[index] = bucket_id
+            self._sums[index] = value
+            self._counts[index] = 1
+            self._maxes[index] = value
+        else:
+            self._sums[index] += value
+            self._counts[index] += 1
+            if value > self._maxes[index]:
+                self._maxes[index] = value
+
+    def stats(self, timestamp : float) -> tuple:
+        '''Return (mean, max, sample count) over the buckets still inside the window'''
+        oldest_bucket_id = int(timestamp / self._bucket_secs) - self._bucket_count + 1
+        total = 0.0
+        count = 0
+        max_value = 0.0
+        for index in range(self._bucket_count):
+            if self._bucket_ids[index] >= oldest_bucket_id:
+                total += self._sums[index]
+                count += self._counts[index]
+                if self._maxes[index] > max_value:
+                    max_value = self._maxes[index]
+        mean = total / count if count > 0 else 0.0
+        return (mean, max_value, count)
+
+class FlowMonitor:
+
+    # Private Class Constants
+    _log_key = "flow_monitor"
+    _IDLE_ZONE_NAME = "Idle"
+    _DEFAULT_FLOW_STATUS_TOPIC = "flow_status"
+
+    # Default Settings - overridden by the 'flow_monitor' config section
+    _DEFAULT_WINDOW_SECS = 30
+    _DEFAULT_BUCKET_SECS = 1
+    _DEFAULT_SETTLE_SECS = 60
+    _DEFAULT_FLOW_TOLERANCE_PCT = 25
+    _DEFAULT_IDLE_FLOW_THRESHOLD = 0.5
+    _DEFAULT_MAX_SAMPLE_GAP_SECS = 5
+    _DEFAULT_STATUS_INTERVAL_SECS = 5
+
+    def __init__(self,
+                 app_config : controller_config.ConfigManager,
+                 app_logger : logger.Logger):
+        self._logger = app_logger
+        monitor_config = app_config.active_config.get('flow_monitor', {})
+        self._window_secs = monitor_config.get('window_secs', self._DEFAULT_WINDOW_SECS)
+        self._bucket_secs = monitor_config.get('bucket_secs', self._DEFAULT_BUCKET_SECS)
+        # Only judge a window once it holds nothing from before the last valve change
+        self._settle_secs = max(monitor_config.get('settle_secs', self._DEFAULT_SETTLE_SECS), self._window_secs)
+        self._flow_tolerance = monitor_config.get('flow_tolerance_pct', self._DEFAULT_FLOW_TOLERANCE_PCT) / 100
+        self._idle_flow_threshold = monitor_config.get('idle_flow_threshold', self._DEFAULT_IDLE_FLOW_THRESHOLD)
+        self._max_sample_gap_secs = monitor_config.get('max_sample_gap_secs', self._DEFAULT_MAX_SAMPLE_GAP_SECS)
+        self.status_interval_secs = monitor_config.get('status_interval_secs', self._DEFAULT_STATUS_INTERVAL_SECS)
+
+        self.status_topic = app_config.active_config.get('publish', {}).get('flow_status', self._DEFAULT_FLOW_STATUS_TOPIC)
+        self.meter_topics = list()
+        for meter_topic in app_config.active_config.get('subscribe', {}).get('flow_meters', []):
+            if '+' in meter_topic or '#' in meter_topic:
+                self._logger.write(self._log_key, f"Ignoring flow meter topic with wildcard (full topic paths only): {meter_topic}", logger.MessageLevel.ERROR)
+            else:
+                self.meter_topics.append(meter_topic)
+        self._windows = {topic : RollingWindow(self._window_secs, self._bucket_secs) for topic in self.meter_topics}
+        self._last_sample = dict()
+        self._zone_totals = defaultdict(float)
+        self._parse_errors = defaultdict(int)
+        self._parse_error_log_time = dict()
+        self._lock = threading.Lock()
+        self._active_zone = None
+        self._active_zone_name = self._IDLE_ZONE_NAME
+        self._zone_change_time = time.monotonic()
+        self._alarm = ALARM_NONE
+
+    ''' ------------------------ Public Functions ------------------------ '''
+    def is_enabled(self) -> bool:
+        '''Return true/false if any flow meters are configured'''
+        return len(self.meter_topics) > 0
+
+    def is_meter_topic(self, topic : str) -> bool:
+        return topic in self._windows
+
+    def add_sample(self, topic : str, payload : bytes):
+        '''Fold a flow meter sample into its rolling window - called from the MQTT thread'''
+        now = time.monotonic()
+        try:
+            flow_rate = self._parse_flow_rate(payload)
+        except (ValueError, TypeError, KeyError):
+            self._parse_error(topic, payload, now)
+            return
+        with self._lock:
+            self._windows[topic].add(flow_rate, now)
+            # Integrate the previous rate over the gap; long gaps (meter offline) are clipped
+            last_sample = self._last_sample.get(topic)
+            if last_sample is not None:
+                (last_time, last_rate) = last_sample
+                gap_secs = min(now - last_time, self._max_sample_gap_secs)
+                self._zone_totals[self._active_zone_name] += last_rate * gap_secs / 60
+            self._last_sample[topic] = (now, flow_rate)
+
+    def set_active_zone(self, zone_record : zone.ZoneRecord):
+        '''Attribute subsequent flow to a zone (None = idle) and restart the settle timer'''
+        zone_name = zone_record.zone_name if zone_record is not None else self._IDLE_ZONE_NAME
+        with self._lock:
+            self._active_zone = zone_record
+            self._active_zone_name = zone_name
+            self._zone_change_time = time.monotonic()
+
+    def evaluate(self) -> dict:
+        '''Compare the rolling flow against the active zone (or idle) and return a status dictionary'''
+        now = time.monotonic()
+        status = defaultdict()
+        status['meters'] = defaultdict()
+        total_mean = 0.0
+        total_samples = 0
+        with self._lock:
+            for topic, window in self._windows.items():
+                (mean, max_value, count) = window.stats(now)
+                status['meters'][topic] = {'mean_flow': mean, 'max_flow': max_value, 'samples': count}
+                total_mean += mean
+                total_samples += count
+            status['zone_totals'] = dict(self._zone_totals)
+            status['parse_errors'] = dict(self._parse_errors)
+            # Same snapshot decides the settle window and the comparison
+            active_zone = self._active_zone
+            active_zone_name = self._active_zone_name
+            settled = (now - self._zone_change_time) >= self._settle_secs
+
+        expected_flow = 0
+        if active_zone is not None:
+            expected_flow = getattr(active_zone, 'expected_flow', 0)
+
+        # Unsettled windows still hold flow from before the last valve change; don't judge them
+        alarm = ALARM_NONE
+        if not settled:
+            pass
+        elif total_samples == 0:
+            alarm = ALARM_NO_DATA
+        elif active_zone is None:
+            if total_mean > self._idle_flow_threshold:
+                alarm = ALARM_IDLE_FLOW
+        elif expected_flow > 0:
+            if total_mean > expected_flow * (1 + self._flow_tolerance):
+                alarm = ALARM_HIGH_FLOW
+            elif total_mean < expected_flow * (1 - self._flow_tolerance):
+                alarm = ALARM_LOW_FLOW
+        self._set_alarm(alarm, active_zone_name, total_mean, expected_flow)
+
+        status['active_zone'] = active_zone_name
+        status['mean_flow'] = total_mean
+        status['expected_flow'] = expected_flow
+        status['alarm'] = self._alarm
+        return status
+
+    ''' ------------------------ Private Functions ------------------------ '''
+    def _parse_flow_rate(self, payload : bytes) -> float:
+        '''Accept either a bare number or a {"value": x} payload; bool, NaN and Infinity are rejected'''
+        value = json.loads(payload)
+        if isinstance(value, dict):
+            value = value['value']
+        if isinstance(value, bool):
+            raise ValueError(f"Boolean flow sample: {value}")
+        flow_rate = float(value)
+        # One NaN would poison the zone totals and window mean for good
+        if not math.isfinite(flow_rate):
+            raise ValueError(f"Non-finite flow sample: {flow_rate}")
+        return flow_rate
+
+    def _parse_error(self, topic : str, payload : bytes, now : float):
+        '''Count unparsable samples; log at most once per status interval per topic - called from the MQTT thread'''
+        with self._lock:
+            self._parse_errors[topic] += 1
+            error_count = self._parse_errors[topic]
+            last_log_time = self._parse_error_log_time.get(topic)
+            if last_log_time is not None and (now - last_log_time) < self.status_interval_secs:
+                return
+            self._parse_error_log_time[topic] = now
+        self._logger.write(self._log_key, f"Unable to parse flow sample ({error_count} total): {topic}->[{payload}]", logger.MessageLevel.WARN)
+
+    def _set_alarm(self, alarm : str, zone_name : str, mean_flow : float, expected_flow : float):
+        '''Log alarm transitions only - evaluate() runs every loop'''
+        if alarm == self._alarm:
+            return
+        if alarm == ALARM_NONE:
+            self._logger.write(self._log_key, f"Flow alarm {self._alarm} cleared.", logger.MessageLevel.INFO)
+        else:
+            self._logger.write(self._log_key, f"Flow alarm {alarm}: zone={zone_name}, mean={mean_flow:.2f}, expected={expected_flow}", logger.MessageLevel.WARN)
+        self._alarm = alarm
@@ -57,10 +57,13 @@ class MqttClient:
         '''Return true/false if the MQTT client is connected'''
         return self._mqtt_client.is_connected()
 
-    def subscribe(self, topic) -> None:
+    def subscribe(self, topic, append_base=True) -> None:
         '''Subscribe to a given topic'''
         self._mqtt_client.subscribe(topic)
-        full_topic = self._append_base(topic)
+        if append_base:
+            full_topic = self._append_base(topic)
+        else:
+            full_topic = topic
         self._local_topic_list.append(full_topic)
         self._logger.write(self._log_key, f"Subscribed to {full_topic}", logger.MessageLevel.INFO)
         
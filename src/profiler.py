@@ -0,0 +1,166 @@
+import os
+import io
+import time
+import datetime
+import cProfile
+import pstats
+import threading
+from collections import defaultdict
+
+import logger
+import controller_config
+import elapsed_time
+
+'''
+Profiler - time-boxed cProfile session plus hot-path tracing, started on demand over MQTT.
+
+cProfile only sees the thread that enabled it, so a session must be started from the main loop thread; functions
+that also run on the MQTT thread are traced by temporarily wrapping them on their instance. Nothing is wrapped or
+enabled outside of a session, so the hot loop carries no profiling overhead when profiling is off.
+'''
+
+class HotPathStats:
+    '''Call count / total / max wall time per traced function; shared by all threads'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: [0, 0.0, 0.0])
+
+    def record(self, name : str, duration_secs : float):
+        with self._lock:
+            stat = self._stats[name]
+            stat[0] += 1
+            stat[1] += duration_secs
+            if duration_secs > stat[2]:
+                stat[2] = duration_secs
+
+    def to_dict(self) -> dict:
+        hot_paths = dict()
+        with self._lock:
+            for name, (count, total_secs, max_secs) in self._stats.items():
+                hot_paths[name] = {'calls': count,
+                                   'total_ms': total_secs * 1000,
+                                   'mean_ms': total_secs * 1000 / count,
+                                   'max_ms': max_secs * 1000}
+        return hot_paths
+
+class ProfileSession:
+
+    # Private Class Constants
+    _log_key = "profiler"
+    _REPORT_FOLDER = "profiles"
+    _DEFAULT_PROFILE_STATUS_TOPIC = "profile_status"
+
+    # Default Settings - overridden by the 'profiler' config section
+    _DEFAULT_MAX_DURATION_SECS = 600
+    _DEFAULT_TOP_FUNCTIONS = 15
+
+    def __init__(self,
+                 app_config : controller_config.ConfigManager,
+                 app_logger : logger.Logger,
+                 duration_secs : float):
+        self._logger = app_logger
+        profiler_config = app_config.active_config.get('profiler', {})
+        max_duration_secs = profiler_config.get('max_duration_secs', self._DEFAULT_MAX_DURATION_SECS)
+        self._top_functions = profiler_config.get('top_functions', self._DEFAULT_TOP_FUNCTIONS)
+        self.duration = datetime.timedelta(seconds=min(duration_secs, max_duration_secs))
+        self.status_topic = app_config.active_config.get('publish', {}).get('profile_status', self._DEFAULT_PROFILE_STATUS_TOPIC)
+        self._profile = cProfile.Profile()
+        self._hot_paths = HotPathStats()
+        self._traced = list()
+        self._enabled = False
+        self._timer = None
+        self._start_time = None
+
+    ''' ------------------------ Public Functions ------------------------ '''
+    def trace(self, owner, attr_name : str, trace_name : str):
+        '''Wrap owner.attr_name with a timing wrapper for the length of the session'''
+        original = getattr(owner, attr_name)
+        hot_paths = self._hot_paths
+        def traced(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                hot_paths.record(trace_name, time.perf_counter() - start)
+        # Remember whether the attribute lived on the instance so _restore_traced() can restore it exactly
+        self._traced.append((owner, attr_name, original, attr_name in vars(owner)))
+        setattr(owner, attr_name, traced)
+
+    def start(self):
+        '''Start profiling the calling thread - call from the main loop'''
+        self._logger.write(self._log_key, f"Starting profile session ({self.duration.total_seconds()} secs)...", logger.MessageLevel.INFO)
+        self._start_time = datetime.datetime.now()
+        self._timer = elapsed_time.ElapsedTime(self.duration)
+        self._profile.enable()
+        self._enabled = True
+
+    def is_elapsed(self) -> bool:
+        return self._timer.is_elapsed()
+
+    def abort(self):
+        '''Undo a session that failed to start - restore traced functions and stop profiling if it began'''
+        self._restore_traced()
+        if self._enabled:
+            self._profile.disable()
+            self._enabled = False
+
+    def stop(self) -> dict:
+        '''Stop profiling and restore traced functions (before any report I/O), then write the report and return its summary'''
+        self._profile.disable()
+        self._enabled = False
+        self._restore_traced()
+
+        summary = defaultdict()
+        summary['start_time'] = self._start_time.strftime("%Y-%m-%d %H:%M:%S")
+        summary['end_time'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        summary['duration_secs'] = self._timer.elapsed_time().total_seconds()
+        summary['hot_paths'] = self._hot_paths.to_dict()
+        summary['top_functions'] = self._top_function_list()
+        summary['report_file'] = self._write_report(summary)
+        self._logger.write(self._log_key, f"Profile session stopped; report saved as: {summary['report_file']}", logger.MessageLevel.INFO)
+        return summary
+
+    ''' ------------------------ Private Functions ------------------------ '''
+    def _restore_traced(self):
+        '''Put back every function wrapped by trace()'''
+        for (owner, attr_name, original, on_instance) in reversed(self._traced):
+            if on_instance:
+                setattr(owner, attr_name, original)
+            else:
+                delattr(owner, attr_name)
+        self._traced.clear()
+
+    def _top_function_list(self) -> list:
+        '''Top functions by cumulative time from the main loop thread'''
+        stats = pstats.Stats(self._profile)
+        entries = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+        top_functions = list()
+        for (func, (prim_calls, total_calls, tottime, cumtime, callers)) in entries[:self._top_functions]:
+            top_functions.append({'function': pstats.func_std_string(func),
+                                  'calls': total_calls,
+                                  'tottime_ms': tottime * 1000,
+                                  'cumtime_ms': cumtime * 1000})
+        return top_functions
+
+    def _write_report(self, summary : dict) -> str:
+        '''Write the raw .prof (for snakeviz / pstats) and a text report; return the text report path'''
+        folder_path = os.path.join(os.getcwd(), self._REPORT_FOLDER)
+        if not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+        # Microseconds keep sessions started in the same second from overwriting each other
+        base_name = "profile_" + self._start_time.strftime("%Y%m%d_%H%M%S_%f")
+        self._profile.dump_stats(os.path.join(folder_path, base_name + ".prof"))
+
+        report = io.StringIO()
+        report.write(f"Profile session {summary['start_time']} -> {summary['end_time']} ({summary['duration_secs']:.1f} secs)\n\n")
+        report.write("Hot paths (all threads):\n")
+        for name, stat in summary['hot_paths'].items():
+            report.write(f"  {name.ljust(40)} calls={stat['calls']:<8} total={stat['total_ms']:.3f}ms mean={stat['mean_ms']:.3f}ms max={stat['max_ms']:.3f}ms\n")
+        report.write("\nMain loop thread (cProfile):\n")
+        pstats.Stats(self._profile, stream=report).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self._top_functions)
+
+        report_file_path = os.path.join(folder_path, base_name + ".txt")
+        with open(report_file_path, 'w') as file:
+            file.write(report.getvalue())
+        return report_file_path
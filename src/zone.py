@@ -10,13 +10,15 @@ class ZoneRecord():
         self.mqtt_command = None
         self.zone_index = 0
         self.run_time_seconds = 0
+        self.expected_flow = 0
         
-def CreateZoneRecord(zone_name : str, zone_index : int, mqtt_command : str, run_time_seconds : int):
+def CreateZoneRecord(zone_name : str, zone_index : int, mqtt_command : str, run_time_seconds : int, expected_flow : float = 0):
     zone = ZoneRecord()
     zone.zone_name = zone_name
     zone.zone_index = zone_index
     zone.mqtt_command = mqtt_command
     zone.run_time_seconds = run_time_seconds
+    zone.expected_flow = expected_flow
     return zone
 
 '''A Zone command and state of the command'''